@@ -1,9 +1,26 @@
-import json
+import asyncio
+import copy
+import functools
+import hashlib
+import os
+import random
 import re
+import time
 from pathlib import Path
 
+import aiohttp
+import orjson
 import requests
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+# Separate pools so the blocking getUpdates long-poll never starves
+# sendMessage fan-out, and keepalive connections are reused.
+_updates_session = requests.Session()
+_updates_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+
+_api_session = requests.Session()
+_api_session.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32))
 
 
 class GameNotFoundError(Exception):
@@ -12,19 +29,91 @@ class GameNotFoundError(Exception):
     pass
 
 
-def fetch_game_html(url):
-    try:
-        response = requests.get(url, timeout=15)
-        response.raise_for_status()
-        return response.text
-    except requests.exceptions.HTTPError as err:
-        if err.response.status_code == 404:
-            raise GameNotFoundError(f"Game page not found: {url}") from err
-        raise err
+# Sentinel returned when the server says the page hasn't changed.
+NOT_MODIFIED = object()
+
+# Backoff schedule for transient fetch failures; None means "last try, give up".
+_RETRY_DELAYS = (0.5, 1, 2, 4)
+
+
+def fetch_game_html(url, etag=None, last_modified=None):
+    """Fetches a game page; returns (html, etag, last_modified).
+
+    Sends a conditional GET when validators are given (html is the
+    NOT_MODIFIED sentinel on 304) and retries transient failures
+    (timeouts, 5xx) with backoff + jitter.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    for delay in _RETRY_DELAYS + (None,):
+        try:
+            response = requests.get(url, headers=headers, timeout=15)
+            if response.status_code == 304:
+                return NOT_MODIFIED, etag, last_modified
+            response.raise_for_status()
+            return response.text, response.headers.get("ETag"), response.headers.get("Last-Modified")
+        except requests.exceptions.HTTPError as err:
+            if err.response.status_code == 404:
+                raise GameNotFoundError(f"Game page not found: {url}") from err
+            if delay is None or err.response.status_code < 500:
+                raise
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if delay is None:
+                raise
+        time.sleep(delay + random.uniform(0, 0.5))
+
+
+async def fetch_game_html_async(session, url, etag=None, last_modified=None):
+    """Fetches a game page; returns (html, etag, last_modified).
+
+    Sends a conditional GET when validators from a previous fetch are
+    given; on 304 Not Modified, html is the NOT_MODIFIED sentinel.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    for delay in _RETRY_DELAYS + (None,):
+        try:
+            async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=15)) as response:
+                if response.status == 304:
+                    return NOT_MODIFIED, etag, last_modified
+                if response.status == 404:
+                    raise GameNotFoundError(f"Game page not found: {url}")
+                response.raise_for_status()
+                html = await response.text()
+                return html, response.headers.get("ETag"), response.headers.get("Last-Modified")
+        except aiohttp.ClientResponseError as err:
+            if delay is None or err.status < 500:
+                raise
+        except (TimeoutError, aiohttp.ClientConnectionError):
+            if delay is None:
+                raise
+        await asyncio.sleep(delay + random.uniform(0, 0.5))
+
+
+# Parsed states keyed by sha1(html), so identical bodies skip BeautifulSoup.
+_parse_cache = {}
+
+_TURN_RE = re.compile(r"turn\s+(\d+)", re.IGNORECASE)
+
+# Isolates the status table so the parser never sees the rest of the page.
+_TABLE_RE = re.compile(r'<table[^>]*class="basictab".*?</table>', re.IGNORECASE | re.DOTALL)
 
 
 def parse_game_state(html):
-    soup = BeautifulSoup(html, "html.parser")
+    cache_key = hashlib.sha1(html.encode()).hexdigest()
+    cached = _parse_cache.get(cache_key)
+    if cached is not None:
+        return copy.deepcopy(cached)
+
+    # Cheap regex pre-slice: parse only the status table, not the whole page.
+    table_match = _TABLE_RE.search(html)
+    soup = BeautifulSoup(table_match.group(0) if table_match else html, "lxml")
     table = soup.find("table", class_="basictab")
 
     if not table:
@@ -36,13 +125,13 @@ def parse_game_state(html):
 
     # Header format: "$GAMENAME, turn $TURNINT"
     header_text = rows[0].get_text(strip=True)
-    turn_match = re.search(r"turn\s+(\d+)", header_text, re.IGNORECASE)
+    turn_match = _TURN_RE.search(header_text)
 
     state = {
         "game_name": header_text.split(",")[0].strip(),
         "turn": int(turn_match.group(1)) if turn_match else 0,
         "nations": {},
-        "subscribers": [],  # Default empty list for new games
+        "subscribers": set(),  # Default empty set for new games
     }
 
     # Parse Nation Rows
@@ -54,71 +143,111 @@ def parse_game_state(html):
 
             status = cols[1].get_text(strip=True)
             state["nations"][nation_name] = status
+
+    if len(_parse_cache) > 128:
+        _parse_cache.clear()
+    _parse_cache[cache_key] = copy.deepcopy(state)
     return state
 
 
+# Strips everything except alphanumerics, underscore, space and dash.
+_NON_SAFE_RE = re.compile(r"[^\w \-]")
+
+
+@functools.lru_cache(maxsize=256)
 def _get_filepath(game_name, cache_dir):
-    safe_name = "".join([c for c in game_name if c.isalnum() or c in (" ", "-", "_")]).strip()
+    safe_name = _NON_SAFE_RE.sub("", game_name).strip()
     return Path(cache_dir) / f"{safe_name}.json"
 
 
-def load_state(game_name, cache_dir):
-    """Loads the state dictionary from JSON."""
-    filepath = _get_filepath(game_name, cache_dir)
-    if filepath.exists():
-        try:
-            with open(filepath) as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            return None
-    return None
+# File mtimes and parsed states from the previous load, so a re-load
+# only re-reads files that actually changed on disk.
+_state_mtimes = {}
+_loaded_states = {}
+
+
+def load_all_states(cache_dir):
+    """Loads every cached game state into a dict keyed by game name.
+
+    One os.scandir pass supplies names and stat info together; entries
+    whose mtime is unchanged since the previous load reuse the already
+    parsed in-memory state instead of being re-read.
+    """
+    states = {}
+    with os.scandir(cache_dir) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".json"):
+                continue
+            mtime = entry.stat().st_mtime_ns
+            cached = _loaded_states.get(entry.path)
+            if cached is not None and _state_mtimes.get(entry.path) == mtime:
+                states[cached["game_name"]] = cached
+                continue
+            try:
+                state = orjson.loads(Path(entry.path).read_bytes())
+            except orjson.JSONDecodeError:
+                continue
+            game_name = state.get("game_name")
+            if game_name:
+                state["subscribers"] = set(state.get("subscribers", []))
+                states[game_name] = state
+                _loaded_states[entry.path] = state
+                _state_mtimes[entry.path] = mtime
+    return states
+
+
+# Content hash of the last write per game, to skip no-op disk writes.
+_last_saved_hash = {}
 
 
 def save_state(state, cache_dir):
-    """Saves the state dictionary to JSON."""
-    filepath = _get_filepath(state["game_name"], cache_dir)
-    with open(filepath, "w") as f:
-        json.dump(state, f, indent=4)
-
-
-def add_subscriber(game_name, chat_id, cache_dir):
-    """Adds a chat_id to the subscribers list of a game."""
-    state = load_state(game_name, cache_dir)
-    if not state:
-        return False  # Game doesn't exist locally yet
+    """Saves the state dictionary to JSON atomically (write tmp, then rename).
 
-    if "subscribers" not in state:
-        state["subscribers"] = []
+    Skips the write entirely when the serialized state matches what was
+    last written for this game.
+    """
+    # Subscribers live as a set in memory; serialize as a sorted list.
+    payload = orjson.dumps({**state, "subscribers": sorted(state.get("subscribers", []))}, option=orjson.OPT_SORT_KEYS)
+    state_hash = hash(payload)
+    if _last_saved_hash.get(state["game_name"]) == state_hash:
+        return
 
-    if chat_id not in state["subscribers"]:
-        state["subscribers"].append(chat_id)
-        save_state(state, cache_dir)
+    filepath = _get_filepath(state["game_name"], cache_dir)
+    tmp_path = filepath.with_suffix(".json.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    tmp_path.replace(filepath)
+    _last_saved_hash[state["game_name"]] = state_hash
+
+
+def add_subscriber(state, chat_id):
+    """Adds a chat_id to the subscribers set of an in-memory game state."""
+    state.setdefault("subscribers", set()).add(chat_id)
     return True
 
 
-def remove_subscriber(game_name, chat_id, cache_dir):
-    """Removes a chat_id from the subscribers list."""
-    state = load_state(game_name, cache_dir)
-    if not state:
-        return False
-
-    if "subscribers" in state and chat_id in state["subscribers"]:
-        state["subscribers"].remove(chat_id)
-        save_state(state, cache_dir)
+def remove_subscriber(state, chat_id):
+    """Removes a chat_id from the subscribers set of an in-memory game state."""
+    subscribers = state.get("subscribers", set())
+    if chat_id in subscribers:
+        subscribers.discard(chat_id)
         return True
     return False
 
 
-def get_telegram_updates(bot_token, offset=None):
-    """Fetches new messages from Telegram."""
+def get_telegram_updates(bot_token, offset=None, timeout=25):
+    """Fetches new messages from Telegram via long-polling."""
     url = f"https://api.telegram.org/bot{bot_token}/getUpdates"
-    params = {"timeout": 0, "limit": 100}
+    params = {"timeout": timeout, "limit": 100}
     if offset:
         params["offset"] = offset
 
     try:
-        response = requests.get(url, params=params, timeout=10)
-        return response.json()
+        # Client timeout must stay above the server-side long-poll timeout.
+        response = _updates_session.get(url, params=params, timeout=timeout + 10)
+        return orjson.loads(response.content)
     except Exception as e:
         print(f"Telegram polling error: {e}")
         return None
@@ -132,11 +261,34 @@ def send_telegram(bot_token, chat_ids, message):
     for chat_id in set(chat_ids):
         try:
             payload = {"chat_id": chat_id, "text": message, "parse_mode": "HTML"}
-            requests.post(api_url, json=payload)
+            _api_session.post(api_url, json=payload)
         except Exception as e:
             print(f"Failed to notify chat {chat_id}: {e}")
 
 
+async def _send_one_async(semaphore, session, api_url, chat_id, message):
+    async with semaphore:
+        try:
+            payload = {"chat_id": chat_id, "text": message, "parse_mode": "HTML"}
+            async with session.post(api_url, json=payload) as response:
+                response.raise_for_status()
+        except Exception as e:
+            print(f"Failed to notify chat {chat_id}: {e}")
+
+
+async def send_telegram_async(session, bot_token, chat_ids, message):
+    """Sends a message to a list of chat IDs concurrently."""
+    api_url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+
+    # Telegram allows ~30 messages/sec across chats; stay a little under it.
+    # Created per call so it binds to the running event loop (each check
+    # cycle runs under its own asyncio.run).
+    semaphore = asyncio.Semaphore(25)
+
+    # Deduplicate IDs just in case
+    await asyncio.gather(*(_send_one_async(semaphore, session, api_url, chat_id, message) for chat_id in set(chat_ids)))
+
+
 def generate_change_messages(prev_state, curr_state, url):
     if not prev_state:
         return []
@@ -151,11 +303,12 @@ def generate_change_messages(prev_state, curr_state, url):
         messages.append(msg)
 
     elif curr_turn == prev_turn:
-        changes = []
-        for nation, status in curr_state["nations"].items():
-            prev_status = prev_state["nations"].get(nation)
-            if prev_status != status and status == "Turn played":
-                changes.append(f"📜 <b>{nation}</b> sent their orders.")
+        # Fast path: one C-level dict comparison covers the common "no change" poll.
+        if curr_state["nations"] == prev_state["nations"]:
+            return []
+        # dict items views support set difference directly (C-level).
+        changed = curr_state["nations"].items() - prev_state["nations"].items()
+        changes = [f"📜 <b>{nation}</b> sent their orders." for nation, status in sorted(changed) if status == "Turn played"]
         if changes:
             full_msg = f"🔮 <b>The Pantokrators Herold Reports</b> ({game_name})\n" + "\n".join(changes)
             messages.append(full_msg)
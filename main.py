@@ -1,4 +1,5 @@
 import argparse
+import asyncio
 import json
 import os
 import sys
@@ -6,6 +7,8 @@ import time
 from datetime import datetime
 from pathlib import Path
 
+import aiohttp
+
 import dom6_lib
 
 CONFIG_FILE = "config.json"
@@ -28,7 +31,7 @@ def get_bot_token():
     return token
 
 
-def handle_start_command(bot_token, chat_id, input_text, default_base_url):
+def handle_start_command(bot_token, chat_id, input_text, default_base_url, games):
     """
     Accepts a game name OR a full URL.
     Saves the game and immediately reports the current status.
@@ -44,30 +47,39 @@ def handle_start_command(bot_token, chat_id, input_text, default_base_url):
         target_url = f"{default_base_url.rstrip('/')}/{input_text}.html"
 
     try:
-        html = dom6_lib.fetch_game_html(target_url)
-        state = dom6_lib.parse_game_state(html)
-
-        if not state:
-            raise ValueError("Could not parse game data")
-        state["url"] = target_url
-        existing_state = dom6_lib.load_state(state["game_name"], CACHE_DIR)
-        if existing_state:
-            state["subscribers"] = existing_state.get("subscribers", [])
-        else:
-            state["subscribers"] = []
+        cached_state = next((s for s in games.values() if s.get("url") == target_url), None)
+        etag = cached_state.get("etag") if cached_state else None
+        last_modified = cached_state.get("last_modified") if cached_state else None
+        html, etag, last_modified = dom6_lib.fetch_game_html(target_url, etag, last_modified)
 
-        if chat_id not in state["subscribers"]:
-            state["subscribers"].append(chat_id)
+        if html is dom6_lib.NOT_MODIFIED:
+            state = cached_state
+        else:
+            state = dom6_lib.parse_game_state(html)
+            if not state:
+                raise ValueError("Could not parse game data")
+            state["url"] = target_url
+            state["etag"] = etag
+            state["last_modified"] = last_modified
+            existing_state = cached_state or games.get(state["game_name"])
+            if existing_state:
+                state["subscribers"] = existing_state.get("subscribers", set())
+            else:
+                state["subscribers"] = set()
+
+        dom6_lib.add_subscriber(state, chat_id)
+        games[state["game_name"]] = state
         dom6_lib.save_state(state, CACHE_DIR)
-        dom6_lib.send_telegram(bot_token, [chat_id], f"✅ Game found! Subscribed to <b>{state['game_name']}</b>.")
+        # Single message per command keeps API round-trips (and rate-limit tokens) at one.
+        msg = f"✅ Game found! Subscribed to <b>{state['game_name']}</b>.\n\n"
+        msg += f"📊 <b>Current Status</b>\nTurn: <b>{state['turn']}</b>\n"
         unfinished = [n for n, s in state["nations"].items() if s == "-"]
-        status_msg = f"📊 <b>Current Status</b>\nTurn: <b>{state['turn']}</b>\n"
         if unfinished:
-            status_msg += f"⏳ <b>Waiting ({len(unfinished)}):</b> {', '.join(unfinished)}"
+            msg += f"⏳ <b>Waiting ({len(unfinished)}):</b> {', '.join(unfinished)}"
         else:
-            status_msg += "✅ All turns played (processing?)"
-        status_msg += f"\n<a href='{target_url}'>Link to Status Page</a>"
-        dom6_lib.send_telegram(bot_token, [chat_id], status_msg)
+            msg += "✅ All turns played (processing?)"
+        msg += f"\n<a href='{target_url}'>Link to Status Page</a>"
+        dom6_lib.send_telegram(bot_token, [chat_id], msg)
 
     except dom6_lib.GameNotFoundError:
         dom6_lib.send_telegram(bot_token, [chat_id], f"❌ Game not found at:\n{target_url}")
@@ -76,52 +88,60 @@ def handle_start_command(bot_token, chat_id, input_text, default_base_url):
         dom6_lib.send_telegram(bot_token, [chat_id], "⚠️ Error accessing game. Check bot logs.")
 
 
-def handle_stop_command(bot_token, chat_id, game_name):
+def handle_stop_command(bot_token, chat_id, game_name, games):
     game_name = game_name.strip()
     if not game_name:
         dom6_lib.send_telegram(bot_token, [chat_id], "⚠️ Please specify a game name. Example: <code>stop te26</code>")
         return
 
-    success = dom6_lib.remove_subscriber(game_name, chat_id, CACHE_DIR)
+    state = games.get(game_name)
+    success = dom6_lib.remove_subscriber(state, chat_id) if state else False
     if success:
+        dom6_lib.save_state(state, CACHE_DIR)
         dom6_lib.send_telegram(bot_token, [chat_id], f"🗑️ Unsubscribed from <b>{game_name}</b>.")
     else:
         dom6_lib.send_telegram(bot_token, [chat_id], f"⚠️ You were not subscribed to <b>{game_name}</b>.")
 
 
-def check_all_subscribed_games(config, bot_token):
-    """Iterates through all JSON files in CACHE_DIR and checks for updates."""
+async def check_single_game(session, prev_state, default_base_url, bot_token, games):
+    """Checks one cached game for updates and notifies its subscribers."""
+    game_name = prev_state.get("game_name")
+    subscribers = prev_state.get("subscribers", [])
+    if not subscribers:
+        return
+
+    target_url = prev_state.get("url")
+    if not target_url:
+        target_url = f"{default_base_url.rstrip('/')}/{game_name}.html"
+    try:
+        html, etag, last_modified = await dom6_lib.fetch_game_html_async(session, target_url, prev_state.get("etag"), prev_state.get("last_modified"))
+        if html is dom6_lib.NOT_MODIFIED:
+            return
+        curr_state = dom6_lib.parse_game_state(html)
+        curr_state["subscribers"] = subscribers
+        curr_state["url"] = target_url
+        curr_state["etag"] = etag
+        curr_state["last_modified"] = last_modified
+
+        messages = dom6_lib.generate_change_messages(prev_state, curr_state, target_url)
+        if messages:
+            print(f"[{game_name}] Sending update to {len(subscribers)} subs.")
+            await dom6_lib.send_telegram_async(session, bot_token, subscribers, "\n\n".join(messages))
+        games[game_name] = curr_state
+        dom6_lib.save_state(curr_state, CACHE_DIR)
+    except dom6_lib.GameNotFoundError:
+        print(f"[{game_name}] 404 Not Found at {target_url}")
+    except Exception as e:
+        print(f"[{game_name}] Check failed: {e}")
+
+
+async def check_all_subscribed_games(config, bot_token, games):
+    """Checks all in-memory game states concurrently over one shared session."""
     default_base_url = config.get("base_game_url", "http://www.illwinter.com/dom6")
-    game_files = list(CACHE_DIR.glob("*.json"))
-    for file_path in game_files:
-        try:
-            with open(file_path) as f:
-                prev_state = json.load(f)
-            game_name = prev_state.get("game_name")
-            subscribers = prev_state.get("subscribers", [])
-            if not subscribers:
-                continue
-
-            target_url = prev_state.get("url")
-            if not target_url:
-                target_url = f"{default_base_url.rstrip('/')}/{game_name}.html"
-            try:
-                html = dom6_lib.fetch_game_html(target_url)
-                curr_state = dom6_lib.parse_game_state(html)
-                curr_state["subscribers"] = subscribers
-                curr_state["url"] = target_url
-
-                messages = dom6_lib.generate_change_messages(prev_state, curr_state, target_url)
-                for msg in messages:
-                    print(f"[{game_name}] Sending update to {len(subscribers)} subs.")
-                    dom6_lib.send_telegram(bot_token, subscribers, msg)
-                dom6_lib.save_state(curr_state, CACHE_DIR)
-            except dom6_lib.GameNotFoundError:
-                print(f"[{game_name}] 404 Not Found at {target_url}")
-            except Exception as e:
-                print(f"[{game_name}] Check failed: {e}")
-        except Exception as e:
-            print(f"Error processing file {file_path}: {e}")
+    connector = aiohttp.TCPConnector(limit=20)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tasks = [asyncio.ensure_future(check_single_game(session, prev_state, default_base_url, bot_token, games)) for prev_state in list(games.values())]
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 
 # --- Main Loop ---
@@ -136,6 +156,9 @@ def main():
     bot_token = get_bot_token()
     CACHE_DIR.mkdir(exist_ok=True)
 
+    # All game states live in memory; disk is only touched on change.
+    games = dom6_lib.load_all_states(CACHE_DIR)
+
     base_url = config.get("base_game_url", "http://www.illwinter.com/dom6")
 
     # Telegram polling offset
@@ -148,7 +171,14 @@ def main():
     print("The Pantokrators Herald is listening...")
 
     while True:
-        updates_data = dom6_lib.get_telegram_updates(bot_token, last_update_id + 1)
+        # Long-poll Telegram, but wake up in time for the next game check.
+        if check_interval > 0:
+            remaining = check_interval - (time.time() - last_check_time)
+            poll_timeout = max(0, min(25, int(remaining)))
+        else:
+            poll_timeout = 25
+
+        updates_data = dom6_lib.get_telegram_updates(bot_token, last_update_id + 1, timeout=poll_timeout)
         if updates_data and updates_data.get("ok"):
             for update in updates_data.get("result", []):
                 last_update_id = update["update_id"]
@@ -159,17 +189,18 @@ def main():
 
                     if text.lower().startswith("start "):
                         input_arg = text[6:]  # Name OR URL
-                        handle_start_command(bot_token, chat_id, input_arg, base_url)
+                        handle_start_command(bot_token, chat_id, input_arg, base_url, games)
                     elif text.lower().startswith("stop "):
                         game_target = text[5:]
-                        handle_stop_command(bot_token, chat_id, game_target)
+                        handle_stop_command(bot_token, chat_id, game_target, games)
 
         current_time = time.time()
         if check_interval > 0 and (current_time - last_check_time) > check_interval:
             print(f"⏰ Checking game states at {datetime.now().strftime('%H:%M:%S')}...")
-            check_all_subscribed_games(config, bot_token)
+            asyncio.run(check_all_subscribed_games(config, bot_token, games))
             last_check_time = current_time
-        time.sleep(1)
+        if updates_data is None:
+            time.sleep(1)  # Avoid hammering the API when polling errors out
 
 
 if __name__ == "__main__":